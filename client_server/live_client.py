@@ -6,6 +6,7 @@ import os
 from pathlib import Path
 from os.path import dirname, abspath
 import config_util.logging as log
+from client_server.vc_protocol import encode_message
 
 log_dir = os.path.join(dirname(dirname(abspath(__file__))), 'log')
 
@@ -41,7 +42,7 @@ class VCClient:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
                 logging.info(f'Connecting to server under {self.host}:{self.port}...')
                 sock.connect((self.host, self.port))
-                sock.sendall(payload)
+                sock.sendall(encode_message(payload))
                 sock.close()
                 log.print_and_log(f'Closing connection to server under {self.host}:{self.port}...', log.INFO)
 
@@ -1,9 +1,10 @@
-import socket
-import time
+import asyncio
 import os
 import config_util.cio as cio
+from concurrent.futures import ThreadPoolExecutor
 from os.path import dirname, abspath
 from client_server.vc_queue import VCQueue
+from client_server.vc_protocol import read_message
 import logging
 import config_util.logging as log
 
@@ -28,56 +29,93 @@ class VCServer:
         self.port = port
         self.queue_size = cio.get_queue_size()
         self.task_queue = VCQueue(self.queue_size)
+        # One worker thread: all tasks share the variant caller and must run one after another
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.task_added = asyncio.Event()
+        self.stopped = asyncio.Event()
 
     def run(self):
         """
         Function that runs server on given host and port
         """
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
-            sock.bind((self.host, self.port))
-            sock.listen()
-            log.print_and_log(f'Running now under {self.host}:{self.port}...', log.INFO)
+        try:
+            asyncio.run(self._serve())
+        finally:
+            self.executor.shutdown(wait=True)
+
+    async def _serve(self):
+        """
+        Function that accepts clients and processes queued tasks concurrently until a stop message arrives
+        """
+        server = await asyncio.start_server(self._handle_client, self.host, self.port)
+        consumer = asyncio.create_task(self._consume())
+        log.print_and_log(f'Running now under {self.host}:{self.port}...', log.INFO)
+
+        async with server:
+            await self.stopped.wait()
+
+        consumer.cancel()
+
+    async def _consume(self):
+        """
+        Function that processes queued tasks in the worker thread, so clients are still served meanwhile
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            await self.task_added.wait()
+            self.task_added.clear()
 
+            while not self.task_queue.is_empty():
+                try:
+                    await loop.run_in_executor(self.executor, self.task_queue.process)
+                except Exception as e:
+                    # A failing task must not stop the processing of the ones queued after it
+                    log.print_and_log(f'Task failed: {e!r}', log.ERROR)
+
+    async def _handle_client(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """
+        Function that handles all messages sent over one client connection
+        @param reader: stream of the client connection
+        @param writer: stream of the client connection
+        """
+        try:
             while True:
-                connection, address = sock.accept()
-                with connection:
-                    data = connection.recv(1024)
-                    log.print_and_log(f'Received {data!r}', log.INFO)
+                data = await read_message(reader)
 
-                    recv_data = data.decode('utf-8').split(' ')
+                if data is None:
+                    break
 
-                    if recv_data[0] == 'stop':
-                        ret = self._shutdown_gracefully(sock)
-                        break
+                log.print_and_log(f'Received {data!r}', log.INFO)
 
-                    elif recv_data[0] == 'process' or recv_data[0] == 'write':
-                        logging.info(f'Received {data[0]} with argument {data[1]}')
-                        if self.task_queue.length() < self.queue_size:
-                            self.task_queue.put((recv_data[0], recv_data[1]))
-                        else:
-                            pass
-                            # TODO: ADD MAX QUEUE ERROR
+                recv_data = data.decode('utf-8').split(' ', 1)
 
+                if recv_data[0] == 'stop':
+                    await self._shutdown_gracefully()
+                    break
+
+                elif recv_data[0] == 'process' or recv_data[0] == 'write':
+                    logging.info(f'Received {recv_data[0]} with argument {recv_data[1]}')
+                    if self.task_queue.length() < self.queue_size:
+                        self.task_queue.put((recv_data[0], recv_data[1]))
+                        self.task_added.set()
                     else:
-                        log.print_and_log(f'No such action: {recv_data[0]}', log.ERROR)
+                        pass
+                        # TODO: ADD MAX QUEUE ERROR
 
-                    while not self.task_queue.is_empty():
-                        self.task_queue.process()
-                        #self.task_queue.join()
+                else:
+                    log.print_and_log(f'No such action: {recv_data[0]}', log.ERROR)
+        finally:
+            writer.close()
+            await writer.wait_closed()
 
-    def _shutdown_gracefully(self, sock):
+    async def _shutdown_gracefully(self):
         """
-        Function that shuts down server socket upon corresponding message
-        @param sock: socket to be shutdown
+        Function that stops the server upon corresponding message
         """
-        try:
-            log.print_and_log('Stopping server in 10 seconds...', log.INFO)
-            time.sleep(10)
-            sock.shutdown(socket.SHUT_RDWR)
-            sock.close()
-            return 0
-        except:
-            return -1
+        log.print_and_log('Stopping server in 10 seconds...', log.INFO)
+        await asyncio.sleep(10)
+        self.stopped.set()
 
 
 if __name__ == '__main__':
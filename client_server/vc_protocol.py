@@ -0,0 +1,42 @@
+import asyncio
+import struct
+
+import config_util.logging as log
+
+# Every message is prefixed with its payload length as unsigned 32 bit big-endian integer
+HEADER = struct.Struct('>I')
+# Messages are an action and a file path, anything longer is not a valid frame
+MAX_MESSAGE_SIZE = 65536
+
+
+def encode_message(payload: bytes) -> bytes:
+    """
+    Function that frames a payload for sending
+    @param payload: message content
+    @return: length prefix followed by payload
+    """
+    return HEADER.pack(len(payload)) + payload
+
+
+async def read_message(reader: asyncio.StreamReader) -> bytes:
+    """
+    Function that reads one framed message from an asyncio stream
+    @param reader: stream of a client connection
+    @return: message payload or None if the connection was closed or the message is too long
+    """
+    try:
+        header = await reader.readexactly(HEADER.size)
+        (size,) = HEADER.unpack(header)
+
+        if size > MAX_MESSAGE_SIZE:
+            # Most likely a client that does not prefix its messages with their length
+            log.print_and_log(
+                f'Message length {size} exceeds the maximum of {MAX_MESSAGE_SIZE} bytes, closing connection',
+                log.ERROR
+            )
+            return None
+
+        return await reader.readexactly(size)
+    except asyncio.IncompleteReadError:
+        return None
+
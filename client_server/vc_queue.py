@@ -1,6 +1,5 @@
 import logging
 import os
-import threading
 from queue import Queue
 from variant_caller.live_variant_caller import LiveVariantCaller
 import config_util.cio as cio
@@ -59,7 +58,8 @@ class VCQueue:
                 cio.get_min_total_depth(),
                 cio.get_min_evidence_depth(),
                 cio.get_min_evidence_ratio(),
-                cio.get_max_variants()
+                cio.get_max_variants(),
+                cio.get_workers()
             )
             self.temp_dir = cio.get_temp_dir()
             self.output_dir = cio.get_output_dir()
@@ -96,21 +96,14 @@ class VCQueue:
             log.print_and_log(f'Queue size atm is {self.q.qsize()}', log.DEBUG)
             log.print_and_log(f'Current action is: {action}', log.DEBUG)
 
-            daemon = threading.Thread(name='daemon_vc', target=self._process_bam, args=(path, ))
-
-            #if action == 'process':
-                #self._process_bam(path)
-
+            # Runs in the caller's thread, the server offloads process() to its worker thread
             if action == 'write':
-                daemon = threading.Thread(name='daemon_vc', target=self._write_vcf, args=(path, ))
                 self._write_vcf(path)
+            else:
+                self._process_bam(path)
 
             self.current_size -= 1
 
-            daemon.daemon = True
-            daemon.start()
-            #print(f'Queue size atm is {self.q.qsize()} - {self.current_size}')
-
     def _write_vcf(self, path: str):
         """
         Function acting as wrapper for variant caller's function to write VCF report
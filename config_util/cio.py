@@ -127,6 +127,14 @@ def get_min_base_quality() -> int:
     return int(config['VARIANT_CALLER_PARAMS']['MIN_BASE_QUALITY'])
 
 
+def get_workers() -> int:
+    """
+    Gets field from vc.config_util
+    @return: number of processes used to score sites as int
+    """
+    return int(config['VARIANT_CALLER_PARAMS']['WORKERS'])
+
+
 # Watcher Params
 
 def get_watcher_interval() -> int:
@@ -9,7 +9,7 @@ def main():
 
     min_evidence_depth = 5
     min_evidence_ratio = 0.0
-    max_variants = 1
+    max_variants = 0
     min_total_depth = 10
     min_mapping_quality = 20
     min_base_quality = 30
@@ -0,0 +1,15 @@
+import pysam
+from Cython.Build import cythonize
+from setuptools import Extension, setup
+
+# Only builds the compiled ingest loop: python setup.py build_ext --inplace
+setup(
+    ext_modules=cythonize(
+        Extension(
+            'variant_caller._ingest',
+            ['variant_caller/_ingest.pyx'],
+            include_dirs=pysam.get_include(),
+            define_macros=pysam.get_defines()
+        )
+    )
+)
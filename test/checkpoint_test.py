@@ -0,0 +1,70 @@
+import os
+import pickle
+import tempfile
+import unittest
+
+import pysam
+
+from variant_caller.live_variant_caller import CHECKPOINT_VERSION, LiveVariantCaller
+from variant_caller.structs import Site
+from variant_caller.utils import PHRED_LUT_LIST
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.checkpoint = os.path.join(self.temp_dir.name, 'checkpoint.pkl')
+        reference_file = os.path.join(self.temp_dir.name, 'reference.fasta')
+
+        with open(reference_file, 'w') as fasta_file:
+            fasta_file.write('>NC_045512.2\nACGTACGTAC\n')
+
+        pysam.faidx(reference_file)
+        self.variant_caller = LiveVariantCaller(reference_file, 0, 0, 1, 1, 0.0, 1)
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def write_checkpoint(self, checkpoint):
+        with open(self.checkpoint, 'wb') as file:
+            pickle.dump(checkpoint, file)
+
+    def test_round_trip(self):
+        site = Site('C', 2)
+        site.snvs[1].extend([30, 20])
+        site.errorSums[1] = PHRED_LUT_LIST[30] + PHRED_LUT_LIST[20]
+        self.variant_caller.memory = {1: site}
+
+        self.variant_caller.create_checkpoint(self.checkpoint)
+        self.variant_caller.reset_memory()
+        self.variant_caller.load_checkpoint(self.checkpoint)
+
+        loaded = self.variant_caller.memory[1]
+        self.assertEqual((loaded.reference, loaded.totalDepth), ('C', 2))
+        self.assertEqual(loaded.snvs, [bytearray(), bytearray([30, 20]), bytearray(), bytearray()])
+        self.assertEqual(loaded.errorSums, site.errorSums)
+
+    def test_unversioned_checkpoint(self):
+        self.write_checkpoint({
+            4: {'reference': 'A', 'totalDepth': 4, 'snvs': {'A': [30, 20], 'N': [10], 'T': [15]}, 'indels': {}}
+        })
+
+        self.variant_caller.load_checkpoint(self.checkpoint)
+
+        site = self.variant_caller.memory[4]
+        self.assertEqual((site.reference, site.totalDepth), ('A', 4))
+        self.assertEqual(site.snvs, [bytearray([30, 20]), bytearray(), bytearray(), bytearray([15])])
+        self.assertEqual(site.errorSums, [PHRED_LUT_LIST[30] + PHRED_LUT_LIST[20], 0.0, 0.0, PHRED_LUT_LIST[15]])
+
+    def test_unsupported_version(self):
+        self.write_checkpoint({'version': CHECKPOINT_VERSION + 1, 'memory': {1: 'unknown'}})
+        self.variant_caller.memory = {1: Site('C', 2)}
+
+        self.variant_caller.load_checkpoint(self.checkpoint)
+
+        self.assertEqual(self.variant_caller.memory, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
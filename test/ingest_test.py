@@ -0,0 +1,58 @@
+import os
+import tempfile
+import unittest
+from os.path import dirname, abspath
+from unittest.mock import patch
+
+import pysam
+
+import variant_caller.live_variant_caller as live_variant_caller
+from variant_caller.live_variant_caller import LiveVariantCaller
+
+test_data_dir = os.path.join(dirname(abspath(__file__)), 'testdata')
+
+
+@unittest.skipUnless(live_variant_caller._INGEST_AVAILABLE, 'ingest extension is not built')
+class IngestTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.bam_file = os.path.join(self.temp_dir.name, 'testfile.bam')
+        self.reference_file = os.path.join(self.temp_dir.name, 'reference.fasta')
+
+        pysam.sort('-O', 'bam', '-o', self.bam_file, os.path.join(test_data_dir, 'testfile.sam'))
+        pysam.index(self.bam_file)
+
+        # Only the reference base of a site comes from the FASTA, its content does not matter here
+        with pysam.AlignmentFile(self.bam_file, 'rb') as bam_file, open(self.reference_file, 'w') as fasta_file:
+            for reference, length in zip(bam_file.references, bam_file.lengths):
+                fasta_file.write(f'>{reference}\n')
+                fasta_file.write('ACGT' * (length // 4) + 'ACGT'[:length % 4] + '\n')
+
+        pysam.faidx(self.reference_file)
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def process(self, min_base_quality: int) -> dict:
+        variant_caller = LiveVariantCaller(self.reference_file, min_base_quality, 0, 1, 1, 0.0, 1)
+        variant_caller.process_bam(self.bam_file)
+
+        return {
+            position: (site.reference, site.totalDepth, [bytes(qualities) for qualities in site.snvs], site.errorSums)
+            for position, site in variant_caller.memory.items()
+        }
+
+    def test_compiled_matches_python(self):
+        for min_base_quality in (0, 10, 20):
+            compiled = self.process(min_base_quality)
+
+            with patch.object(live_variant_caller, '_INGEST_AVAILABLE', False):
+                python = self.process(min_base_quality)
+
+            self.assertTrue(compiled)
+            self.assertEqual(compiled, python)
+
+
+if __name__ == '__main__':
+    unittest.main()
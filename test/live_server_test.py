@@ -0,0 +1,71 @@
+import asyncio
+import unittest
+from queue import Queue
+from unittest.mock import patch
+
+# live_server and vc_queue log into ./log on import, which only the run scripts create
+with patch('logging.basicConfig'):
+    from client_server.live_server import VCServer
+
+
+class FailingQueue:
+    """
+    Stand-in for VCQueue that records processed paths and fails for bad.bam
+    """
+
+    def __init__(self, size: int):
+        self.q = Queue(maxsize=size)
+        self.processed = []
+
+    def put(self, action: (str, str)):
+        self.q.put(action)
+
+    def process(self):
+        (action, path) = self.q.get()
+
+        if path == 'bad.bam':
+            raise OSError(f'{path} is corrupt')
+
+        self.processed.append(path)
+
+    def length(self) -> int:
+        return self.q.qsize()
+
+    def is_empty(self) -> bool:
+        return self.q.empty()
+
+
+class VCServerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        with patch('client_server.live_server.VCQueue', FailingQueue):
+            self.server = VCServer()
+
+    def tearDown(self) -> None:
+        self.server.executor.shutdown(wait=True)
+
+    def test_consume_after_failed_task(self):
+        async def consume():
+            consumer = asyncio.create_task(self.server._consume())
+
+            self.server.task_queue.put(('process', 'bad.bam'))
+            self.server.task_added.set()
+            await asyncio.sleep(0.1)
+
+            self.server.task_queue.put(('process', 'z.bam'))
+            self.server.task_added.set()
+
+            for _ in range(50):
+                if self.server.task_queue.processed:
+                    break
+                await asyncio.sleep(0.1)
+
+            self.assertFalse(consumer.done())
+            consumer.cancel()
+
+        asyncio.run(consume())
+        self.assertEqual(self.server.task_queue.processed, ['z.bam'])
+
+
+if __name__ == '__main__':
+    unittest.main()
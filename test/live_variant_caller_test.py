@@ -0,0 +1,166 @@
+import os
+import tempfile
+import unittest
+from os.path import dirname, abspath
+from unittest.mock import patch
+
+import pysam
+
+import variant_caller.live_variant_caller as live_variant_caller
+from variant_caller.live_variant_caller import LiveVariantCaller
+from variant_caller.structs import Site
+from variant_caller.utils import PHRED_LUT_LIST
+
+test_data_dir = os.path.join(dirname(abspath(__file__)), 'testdata')
+
+
+class LiveVariantCallerTest(unittest.TestCase):
+
+    def setUp(self) -> None:
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.reference_file = os.path.join(self.temp_dir.name, 'reference.fasta')
+        self.bam_file = os.path.join(self.temp_dir.name, 'testfile.bam')
+
+        pysam.sort('-O', 'bam', '-o', self.bam_file, os.path.join(test_data_dir, 'testfile.sam'))
+        pysam.index(self.bam_file)
+
+        # Only the reference base of a site comes from the FASTA, its content does not matter here
+        with pysam.AlignmentFile(self.bam_file, 'rb') as bam_file, open(self.reference_file, 'w') as fasta_file:
+            for reference, length in zip(bam_file.references, bam_file.lengths):
+                fasta_file.write(f'>{reference}\n')
+                fasta_file.write('ACGT' * (length // 4) + 'ACGT'[:length % 4] + '\n')
+
+        pysam.faidx(self.reference_file)
+
+    def tearDown(self) -> None:
+        self.temp_dir.cleanup()
+
+    def create_variant_caller(self, max_variants: int = 0, workers: int = 1) -> LiveVariantCaller:
+        return LiveVariantCaller(self.reference_file, 0, 0, 1, 1, 0.0, max_variants, workers)
+
+
+class SelectVariantsTest(LiveVariantCallerTest):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.variants = [
+            {'start': start, 'name': name, 'info': {'SCORE': score}}
+            for start, name, score in [
+                (3, 'a', 5), (1, 'b', 7), (3, 'c', 9), (3, 'd', 5), (1, 'e', 0), (3, 'f', 9), (3, 'g', 1)
+            ]
+        ]
+
+    def select(self, max_variants: int) -> list:
+        variant_caller = self.create_variant_caller(max_variants)
+
+        return [variant['name'] for variant in variant_caller.select_variants(self.variants)]
+
+    def test_no_limit(self):
+        for max_variants in (0, -1):
+            self.assertEqual(self.select(max_variants), ['e', 'b', 'g', 'a', 'd', 'c', 'f'])
+
+    def test_limit_per_position(self):
+        self.assertEqual(self.select(1), ['b', 'c'])
+        self.assertEqual(self.select(4), ['e', 'b', 'a', 'd', 'c', 'f'])
+        self.assertEqual(self.select(10), self.select(0))
+
+    def test_ties(self):
+        # Equal scores keep their input order, with and without a limit
+        self.assertEqual(self.select(2), ['e', 'b', 'c', 'f'])
+        self.assertEqual(self.select(3), ['e', 'b', 'a', 'c', 'f'])
+
+
+class PrepareVariantsTest(LiveVariantCallerTest):
+
+    def write_vcf(self, workers: int) -> bytes:
+        variant_caller = self.create_variant_caller(workers=workers)
+        variant_caller.process_bam(self.bam_file)
+        output_file = os.path.join(self.temp_dir.name, f'workers-{workers}.vcf')
+
+        # Small chunks, so the sites are spread over several worker tasks
+        with patch.object(live_variant_caller, 'SCORING_CHUNK_SIZE', 50):
+            variant_caller.write_vcf(output_file)
+
+        with open(output_file, 'rb') as vcf_file:
+            return vcf_file.read()
+
+    def test_workers_match_serial(self):
+        serial = self.write_vcf(1)
+
+        self.assertGreater(serial.count(b'\n'), 100)
+        self.assertEqual(self.write_vcf(2), serial)
+
+
+class WriteVcfTest(LiveVariantCallerTest):
+
+    def setUp(self) -> None:
+        super().setUp()
+        self.variant_caller = self.create_variant_caller()
+
+        for position, snvs, indels in [
+            (1, {0: [30, 20], 1: [35], 3: [12, 40, 25]}, {}),
+            (2, {2: [30] * 8, 0: [17]}, {'-': [None, None]}),
+            (5, {3: [38, 39]}, {})
+        ]:
+            site = Site('ACGTACGTAC'[position], sum(len(qualities) for qualities in snvs.values()))
+
+            for alleleIndex, qualities in snvs.items():
+                site.snvs[alleleIndex].extend(qualities)
+                site.errorSums[alleleIndex] = sum(PHRED_LUT_LIST[quality] for quality in qualities)
+
+            site.indels = indels
+            self.variant_caller.memory[position] = site
+
+    def read_vcf(self, vcf_file: str) -> bytes:
+        with open(vcf_file, 'rb') as file:
+            return file.read()
+
+    def test_matches_new_records(self):
+        # Same variants written with a new record for every line
+        expected_file = os.path.join(self.temp_dir.name, 'expected.vcf')
+        variants = self.variant_caller.select_variants(self.variant_caller.prepare_variants())
+
+        with pysam.VariantFile(expected_file, mode='w', header=self.variant_caller.vcfHeader) as vcf_file:
+            for variant in variants:
+                vcf_file.write(vcf_file.new_record(
+                    start=variant['start'],
+                    stop=variant['stop'],
+                    alleles=variant['alleles'],
+                    qual=variant['qual'],
+                    info=variant['info']
+                ))
+
+        # Written twice to also cover the cached header
+        for name in ('first.vcf', 'second.vcf'):
+            output_file = os.path.join(self.temp_dir.name, name)
+            self.variant_caller.write_vcf(output_file)
+
+            self.assertEqual(self.read_vcf(output_file), self.read_vcf(expected_file))
+
+        self.assertEqual(len(variants), 5)
+
+    def test_info_cleared(self):
+        infos = [
+            {'DP': 10, 'AD': 4, 'GL': -1.5, 'PL': 15, 'SCORE': 20},
+            {'DP': 12, 'SCORE': 0},
+            {'AD': 3, 'SCORE': 7},
+            {'SCORE': 1}
+        ]
+        variants = [
+            {'start': index, 'stop': index + 1, 'alleles': ('A', 'C'), 'qual': 0.5, 'info': info}
+            for index, info in enumerate(infos)
+        ]
+        output_file = os.path.join(self.temp_dir.name, 'output.vcf')
+
+        with patch.object(self.variant_caller, 'prepare_variants', return_value=variants):
+            self.variant_caller.write_vcf(output_file)
+
+        with pysam.VariantFile(output_file) as vcf_file:
+            records = [dict(record.info) for record in vcf_file]
+
+        self.assertEqual([set(info) for info in records], [set(info) for info in infos])
+        self.assertEqual(records[2], {'AD': 3, 'SCORE': 7.0})
+
+
+if __name__ == '__main__':
+    unittest.main()
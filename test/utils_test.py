@@ -0,0 +1,146 @@
+import math
+import unittest
+
+import numpy as np
+
+from variant_caller.utils import (
+    PHRED_LUT,
+    from_phred_scale,
+    score_sites,
+    snvs_to_csr,
+    to_phred_scale,
+    _score_sites_numba,
+    _score_sites_numpy
+)
+
+
+def product_scores(site: list) -> tuple:
+    """
+    GL, PL and SCORE of every allele with the product formula scoring used before log10 space
+    @param site: base qualities per allele
+    @return: GL, PL and SCORE lists
+    """
+    errors = [[from_phred_scale(quality) for quality in qualities] for qualities in site]
+    likelihoods = [
+        math.prod(1.0 - error for error in errors[index])
+        * math.prod(math.prod(errors[other]) for other in range(len(site)) if other != index)
+        if errors[index] else 0.0
+        for index in range(len(site))
+    ]
+    total = sum(likelihoods) or 1.0
+
+    gl = [math.log10(likelihood) if likelihood != 0 else 0.0 for likelihood in likelihoods]
+    pl = [round(-10.0 * value) for value in gl]
+    score = [
+        to_phred_scale(1.0 - likelihood / total) if errors[index] else 0
+        for index, likelihood in enumerate(likelihoods)
+    ]
+
+    return gl, pl, score
+
+
+class PhredScaleTest(unittest.TestCase):
+
+    def test_from_phred_scale(self):
+        self.assertAlmostEqual(from_phred_scale(0), 1.0)
+        self.assertAlmostEqual(from_phred_scale(20), 0.01)
+        self.assertEqual(from_phred_scale(30), PHRED_LUT[30])
+
+    def test_to_phred_scale(self):
+        self.assertEqual(to_phred_scale(0.01), 20)
+        self.assertEqual(to_phred_scale(1.0), 0)
+        self.assertEqual(to_phred_scale(1e-12), 99)
+        self.assertEqual(to_phred_scale(0.0), 99)
+        self.assertEqual(to_phred_scale(1e-12, threshold=60), 60)
+
+
+class SnvsToCsrTest(unittest.TestCase):
+
+    def test_offsets(self):
+        snvs = [
+            [bytearray([30, 20]), bytearray(), bytearray([10]), bytearray()],
+            [bytearray(), bytearray([40, 41, 42]), bytearray(), bytearray([5])]
+        ]
+        qualities, offsets = snvs_to_csr(snvs)
+
+        self.assertEqual(qualities.dtype, np.uint8)
+        self.assertEqual(qualities.tolist(), [30, 20, 10, 40, 41, 42, 5])
+        self.assertEqual(offsets.tolist(), [0, 2, 2, 3, 3, 3, 6, 6, 7])
+
+        # Qualities of allele a at site s
+        self.assertEqual(qualities[offsets[1 * 4 + 1]:offsets[1 * 4 + 2]].tolist(), [40, 41, 42])
+
+    def test_empty(self):
+        qualities, offsets = snvs_to_csr([])
+
+        self.assertEqual(qualities.size, 0)
+        self.assertEqual(offsets.tolist(), [0])
+
+
+class ScoreSitesTest(unittest.TestCase):
+
+    def score(self, snvs: list) -> tuple:
+        qualities, offsets = snvs_to_csr(snvs)
+
+        return score_sites(qualities, offsets, 4)
+
+    def test_product_formula(self):
+        site = [bytearray([30, 25, 12]), bytearray([8]), bytearray(), bytearray([17, 3])]
+        gl, pl, score = self.score([site])
+        expectedGl, expectedPl, expectedScore = product_scores(site)
+
+        np.testing.assert_allclose(gl[0], expectedGl, rtol=1e-9)
+        self.assertEqual(pl[0].tolist(), expectedPl)
+        self.assertEqual(score[0].tolist(), expectedScore)
+
+    def test_deep_site(self):
+        # The product formula underflows to 0 for both alleles here
+        site = [bytearray([30] * 1500), bytearray([20] * 300), bytearray(), bytearray()]
+        gl, pl, score = self.score([site])
+
+        self.assertTrue(np.all(np.isfinite(gl)))
+        self.assertAlmostEqual(gl[0, 0], 1500 * math.log10(1.0 - 1e-3) - 300 * 2.0, places=6)
+        self.assertAlmostEqual(gl[0, 1], 300 * math.log10(1.0 - 1e-2) - 1500 * 3.0, places=6)
+        self.assertEqual(pl[0, 1], round(-10.0 * gl[0, 1]))
+        self.assertEqual(score[0].tolist(), [99, 0, 0, 0])
+
+    def test_quality_zero(self):
+        # A read with error probability 1 makes its allele impossible
+        gl, pl, score = self.score([[bytearray([0]), bytearray([30]), bytearray(), bytearray()]])
+
+        self.assertEqual(gl[0, 0], 0.0)
+        self.assertEqual(pl[0, 0], 0)
+        self.assertEqual(score[0, 0], 0)
+
+    def test_single_allele(self):
+        gl, pl, score = self.score([[bytearray(), bytearray(), bytearray([35, 40]), bytearray()]])
+
+        self.assertEqual(score[0].tolist(), [0, 0, 99, 0])
+        self.assertEqual(pl[0, 2], 0)
+
+    def test_empty(self):
+        for scoreSites in (_score_sites_numba, _score_sites_numpy):
+            gl, pl, score = scoreSites(*snvs_to_csr([]), 4)
+
+            self.assertEqual(gl.shape, (0, 4))
+            self.assertEqual(pl.shape, (0, 4))
+            self.assertEqual(score.shape, (0, 4))
+
+    def test_numba_numpy_agreement(self):
+        random = np.random.default_rng(7)
+        snvs = [
+            [bytearray(random.integers(0, 60, random.integers(0, 30)).astype(np.uint8).tobytes()) for _ in range(4)]
+            for _ in range(500)
+        ]
+        qualities, offsets = snvs_to_csr(snvs)
+
+        numbaGl, numbaPl, numbaScore = _score_sites_numba(qualities, offsets, 4)
+        numpyGl, numpyPl, numpyScore = _score_sites_numpy(qualities, offsets, 4)
+
+        np.testing.assert_allclose(numbaGl, numpyGl, rtol=1e-9)
+        np.testing.assert_array_equal(numbaPl, numpyPl)
+        np.testing.assert_array_equal(numbaScore, numpyScore)
+
+
+if __name__ == '__main__':
+    unittest.main()
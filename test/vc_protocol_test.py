@@ -0,0 +1,75 @@
+import asyncio
+import unittest
+
+from client_server.vc_protocol import MAX_MESSAGE_SIZE, encode_message, read_message
+
+
+class VCProtocolTest(unittest.TestCase):
+
+    def read_messages(self, chunks: list, count: int) -> list:
+        """
+        Feeds the chunks into a stream, closes it and reads count messages from it
+        """
+        async def read():
+            reader = asyncio.StreamReader()
+
+            for chunk in chunks:
+                reader.feed_data(chunk)
+
+            reader.feed_eof()
+
+            return [await read_message(reader) for _ in range(count)]
+
+        return asyncio.run(read())
+
+    def test_single_message(self):
+        messages = self.read_messages([encode_message(b'process test.bam')], 1)
+        self.assertEqual(messages, [b'process test.bam'])
+
+    def test_multiple_messages(self):
+        data = encode_message(b'process a.bam') + encode_message(b'write a.bam') + encode_message(b'stop')
+        messages = self.read_messages([data], 4)
+        self.assertEqual(messages, [b'process a.bam', b'write a.bam', b'stop', None])
+
+    def test_fragmented_messages(self):
+        payload = b'process /' + b'x' * 5000 + b'.bam'
+        data = encode_message(payload) + encode_message(b'stop')
+        chunks = [data[index:index + 7] for index in range(0, len(data), 7)]
+        messages = self.read_messages(chunks, 2)
+        self.assertEqual(messages, [payload, b'stop'])
+
+    def test_empty_message(self):
+        messages = self.read_messages([encode_message(b'')], 1)
+        self.assertEqual(messages, [b''])
+
+    def test_closed_connection(self):
+        self.assertEqual(self.read_messages([], 1), [None])
+
+    def test_closed_in_header(self):
+        data = encode_message(b'stop') + encode_message(b'process a.bam')[:2]
+        self.assertEqual(self.read_messages([data], 2), [b'stop', None])
+
+    def test_closed_in_payload(self):
+        data = encode_message(b'process a.bam')[:-3]
+        self.assertEqual(self.read_messages([data], 1), [None])
+
+    def test_maximum_size(self):
+        payload = b'x' * MAX_MESSAGE_SIZE
+        self.assertEqual(self.read_messages([encode_message(payload)], 1), [payload])
+
+    def test_too_long(self):
+        with self.assertLogs(level='ERROR'):
+            messages = self.read_messages([encode_message(b'x' * (MAX_MESSAGE_SIZE + 1))], 1)
+
+        self.assertEqual(messages, [None])
+
+    def test_unframed_message(self):
+        # Without length prefix b'proc' is read as a length of about 1.9 GB
+        with self.assertLogs(level='ERROR'):
+            messages = self.read_messages([b'process a.bam'], 1)
+
+        self.assertEqual(messages, [None])
+
+
+if __name__ == '__main__':
+    unittest.main()
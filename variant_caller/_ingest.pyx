@@ -0,0 +1,85 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+from libc.stdint cimport uint8_t, uint32_t
+
+from pysam.libcalignedsegment cimport PileupColumn
+from pysam.libchtslib cimport bam_pileup1_t, bam_get_qual, bam_get_seq, bam_seqi
+
+from .structs import Site
+from .utils import PHRED_LUT
+
+# Index into ALLELES for every 4 bit htslib base code (=ACMGRSVTWYHKDBN), -1 for ambiguous bases
+cdef int BASE_IDX[16]
+cdef double PHRED[256]
+
+for _code in range(16):
+    BASE_IDX[_code] = -1
+
+BASE_IDX[1] = 0
+BASE_IDX[2] = 1
+BASE_IDX[4] = 2
+BASE_IDX[8] = 3
+
+for _quality in range(256):
+    PHRED[_quality] = PHRED_LUT[_quality]
+
+
+def ingest_column(PileupColumn column, dict memory, str reference):
+    """
+    Adds all reads of a pileup column to the site at its position, same as
+    LiveVariantCaller.process_pileup_column but reading the bases and qualities straight from htslib
+    @param column: pileup column
+    @param memory: sites by position
+    @param reference: reference sequence
+    """
+    cdef const bam_pileup1_t * pileup
+    cdef uint32_t quality
+    cdef int index, alleleIndex
+    cdef int totalDepth = 0
+    cdef int position = column.pos
+    cdef double errorSums[4]
+
+    if column.plp == NULL or column.plp[0] == NULL:
+        raise ValueError('PileupColumn accessed after iterator finished')
+
+    site = memory.get(position)
+
+    if site is None:
+        site = memory[position] = Site(reference[position])
+
+    cdef list snvs = site.snvs
+    cdef list siteErrorSums = site.errorSums
+
+    for alleleIndex in range(4):
+        errorSums[alleleIndex] = siteErrorSums[alleleIndex]
+
+    for index in range(column.n_pu):
+        pileup = &column.plp[0][index]
+
+        # Same base quality filter pysam applies to PileupColumn.pileups
+        if pileup.qpos < pileup.b.core.l_qseq:
+            quality = bam_get_qual(pileup.b)[pileup.qpos]
+        else:
+            quality = 0
+
+        if quality < column.min_base_quality:
+            continue
+
+        totalDepth += 1
+
+        # Reads without SEQ have no base at qpos
+        if pileup.is_del or pileup.is_refskip or pileup.qpos >= pileup.b.core.l_qseq:
+            continue
+
+        alleleIndex = BASE_IDX[bam_seqi(bam_get_seq(pileup.b), pileup.qpos)]
+
+        # Ambiguous bases (N) carry no evidence for any allele
+        if alleleIndex < 0:
+            continue
+
+        (<bytearray> snvs[alleleIndex]).append(<uint8_t> quality)
+        errorSums[alleleIndex] += PHRED[quality]
+
+    for alleleIndex in range(4):
+        siteErrorSums[alleleIndex] = errorSums[alleleIndex]
+
+    site.totalDepth += totalDepth
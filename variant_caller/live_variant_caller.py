@@ -1,8 +1,11 @@
-import functools
-import operator
+import heapq
+import multiprocessing
 import pickle
-import math
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from itertools import groupby, repeat
+from operator import itemgetter
+from typing import List, Tuple
 
 import pysam
 import numpy as np
@@ -14,20 +17,130 @@ from time import strftime, localtime
 import logging
 import config_util.logging as log
 
-from .structs import Site, Variant
-from .utils import genotype_likelihood, from_phred_scale, to_phred_scale
+from .structs import ALLELES, ALLELE_INDEX, Site, Variant
+from .utils import PHRED_LUT_LIST, score_sites, snvs_to_csr
+
+try:
+    # Compiled with python setup.py build_ext --inplace
+    from ._ingest import ingest_column
+    _INGEST_AVAILABLE = True
+except (ImportError, ValueError):
+    # ValueError: built against a different pysam version ("size changed, may indicate binary incompatibility")
+    _INGEST_AVAILABLE = False
+
+
+# Number of sites scored per task when scoring runs in worker processes
+SCORING_CHUNK_SIZE = 1000
+# write_vcf runs in a thread of the live server and forking a threaded process can deadlock,
+# so the scoring workers are started from a fresh process instead
+SCORING_MP_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+# Stored with every checkpoint, increase it whenever the layout of Site changes
+CHECKPOINT_VERSION = 2
+
+
+def convert_legacy_site(site: dict) -> Site:
+    """
+    Converts a site of an unversioned checkpoint, where sites were dicts with qualities per base
+    @param site: legacy site dict
+    @return: equivalent site
+    """
+    converted = Site(site['reference'], site['totalDepth'])
+
+    for base, qualities in site['snvs'].items():
+        alleleIndex = ALLELE_INDEX.get(base)
+
+        # Ambiguous bases (N) carry no evidence for any allele
+        if alleleIndex is not None:
+            converted.snvs[alleleIndex].extend(qualities)
+
+            for quality in qualities:
+                converted.errorSums[alleleIndex] += PHRED_LUT_LIST[quality]
+
+    converted.indels = site['indels']
+
+    return converted
+
+
+def variant_score(variant: Variant) -> int:
+    """
+    Sort key of variants
+    @param variant: variant
+    @return: SCORE of the variant
+    """
+    return variant['info']['SCORE']
+
+
+def call_snvs(sites: List[Tuple[int, Site]], minAlleleDepth: int, minEvidenceRatio: float) -> List[Variant]:
+    """
+    Scores the given sites and returns the SNVs passing the filters. Module level so it can be
+    shipped to worker processes
+    @param sites: (position, site) tuples
+    @param minAlleleDepth: minimal number of reads supporting the allele
+    @param minEvidenceRatio: minimal ratio of reads supporting the allele
+    @return: SNV variants
+    """
+    qualities, offsets = snvs_to_csr([site.snvs for _, site in sites])
+    gl, pl, score = score_sites(qualities, offsets, len(ALLELES))
+
+    alleleDepths = np.diff(offsets).reshape(len(sites), len(ALLELES))
+    totalDepths = np.fromiter((site.totalDepth for _, site in sites), dtype=np.int64, count=len(sites))
+    references = np.fromiter(
+        (ALLELE_INDEX.get(site.reference, -1) for _, site in sites),
+        dtype=np.int64,
+        count=len(sites)
+    )
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        filterConstrains = (
+            (alleleDepths > 0)
+            & (np.arange(len(ALLELES)) != references[:, np.newaxis])
+            & (alleleDepths >= minAlleleDepth)
+            & (alleleDepths / totalDepths[:, np.newaxis] >= minEvidenceRatio)
+        )
+
+    variants: List[Variant] = []
+
+    for siteIndex, alleleIndex in zip(*np.nonzero(filterConstrains)):
+        position, site = sites[siteIndex]
+        alleleDepth = int(alleleDepths[siteIndex, alleleIndex])
+
+        variants.append({
+            'start': position,
+            'stop': position + 1,
+            'alleles': (
+                site.reference,
+                ALLELES[alleleIndex]
+            ),
+            'qual': site.errorSums[alleleIndex] / alleleDepth,
+            'info': {
+                'DP': site.totalDepth,
+                'AD': alleleDepth,
+                'GL': float(gl[siteIndex, alleleIndex]),
+                'PL': int(pl[siteIndex, alleleIndex]),
+                'SCORE': int(score[siteIndex, alleleIndex])
+            }
+        })
+
+    return variants
 
 
 class LiveVariantCaller:
     def __init__(self, referenceFasta: str, minBaseQuality: int, minMappingQuality: int, minTotalDepth: int,
-                 minAlleleDepth: int, minEvidenceRatio: float, maxVariants: int):
+                 minAlleleDepth: int, minEvidenceRatio: float, maxVariants: int, workers: int = 1):
         self.minBaseQuality = minBaseQuality
         self.minMappingQuality = minMappingQuality
         self.minTotalDepth = minTotalDepth
         self.minAlleleDepth = minAlleleDepth
         self.minEvidenceRatio = minEvidenceRatio
         self.maxVariants = maxVariants
+        self.workers = workers
         self.fastaFile = pysam.FastaFile(referenceFasta)
+        self.referenceLengths = {
+            reference: self.fastaFile.get_reference_length(reference) for reference in self.fastaFile.references
+        }
+        self.vcfHeader = self.create_vcf_header()
         self.memory = {}
         self.reset_memory()
 
@@ -41,16 +154,30 @@ class LiveVariantCaller:
         log.print_and_log(f'Creating checkpoint {filename}', log.INFO)
         print('SELF.MEMORY', type(self.memory))
         file = open(filename, 'wb')
-        pickle.dump(self.memory, file)
+        pickle.dump({'version': CHECKPOINT_VERSION, 'memory': self.memory}, file)
         file.close()
 
     def load_checkpoint(self, filename):
         log.print_and_log(f'Loading checkpoint {filename}', log.INFO)
 
         file = open(filename, 'rb')
-        self.memory = pickle.load(file)
+        checkpoint = pickle.load(file)
         file.close()
 
+        if checkpoint.get('version') == CHECKPOINT_VERSION:
+            self.memory = checkpoint['memory']
+        elif 'version' not in checkpoint and all(isinstance(site, dict) for site in checkpoint.values()):
+            # Unversioned checkpoints hold the memory itself with sites as dicts
+            log.print_and_log(f'Converting unversioned checkpoint {filename}', log.WARNING)
+            self.memory = {position: convert_legacy_site(site) for position, site in checkpoint.items()}
+        else:
+            log.print_and_log(
+                f'Ignoring checkpoint {filename} with unsupported version {checkpoint.get("version")}, '
+                f'expected version {CHECKPOINT_VERSION}',
+                log.ERROR
+            )
+            self.reset_memory()
+
     def process_bam(self, inputBam: str, referenceIndex=0):
         bamFile = pysam.AlignmentFile(inputBam, 'rb')
         pileupColumns = bamFile.pileup(
@@ -58,6 +185,7 @@ class LiveVariantCaller:
             min_base_quality=self.minBaseQuality,
             reference=self.fastaFile.references[referenceIndex]
         )
+        reference = self.fastaFile.fetch(reference=self.fastaFile.references[referenceIndex])
 
         timestamp = strftime('[%Y-%m-%d %H:%M:%S]', localtime())
         progressBar = tqdm(
@@ -67,171 +195,150 @@ class LiveVariantCaller:
         )
 
         for pileupColumn in progressBar:
-            self.process_pileup_column(pileupColumn)
+            self.process_pileup_column(pileupColumn, reference)
 
         bamFile.close()
 
-    def process_pileup_column(self, pileupColumn: AlignedSegment):
-        totalDepth = len(pileupColumn.pileups)
+    def process_pileup_column(self, pileupColumn: AlignedSegment, reference: str):
+        if _INGEST_AVAILABLE:
+            ingest_column(pileupColumn, self.memory, reference)
+            return
 
-        if pileupColumn.reference_pos not in self.memory:
-            reference = self.fastaFile.fetch(reference=pileupColumn.reference_name)
+        position = pileupColumn.reference_pos
+        pileups = pileupColumn.pileups
+        totalDepth = len(pileups)
 
-            self.memory[pileupColumn.reference_pos] = {
-                'reference': reference[pileupColumn.reference_pos],
-                'totalDepth': totalDepth,
-                'snvs': {},
-                'indels': {}
-            }
+        if position not in self.memory:
+            self.memory[position] = Site(reference[position], totalDepth)
         else:
-            self.memory[pileupColumn.reference_pos]['totalDepth'] += totalDepth
+            self.memory[position].totalDepth += totalDepth
 
-        for pileup in pileupColumn.pileups:
-            self.process_pileup_at_position(pileupColumn.reference_pos, pileup)
+        for pileup in pileups:
+            self.process_pileup_at_position(position, pileup)
 
     def process_pileup_at_position(self, position: int, pileup):
+        # Only used without the compiled extension, ingest_column in _ingest.pyx replaces this method,
+        # process_svn and process_indel and has to be changed along with them
         self.process_svn(position, pileup)
         # self.process_indel(position, pileup)
 
     def process_svn(self, position, pileup):
         if not pileup.is_del and not pileup.is_refskip:
-            svn = pileup.alignment.query_sequence[pileup.query_position]
+            alignment = pileup.alignment
+            queryPosition = pileup.query_position
+            alleleIndex = ALLELE_INDEX.get(alignment.query_sequence[queryPosition])
 
-            if svn not in self.memory[position]['snvs'].keys():
-                self.memory[position]['snvs'][svn] = []
+            # Ambiguous bases (N) carry no evidence for any allele
+            if alleleIndex is not None:
+                site = self.memory[position]
+                quality = alignment.query_qualities[queryPosition]
 
-            self.memory[position]['snvs'][svn].append(pileup.alignment.query_qualities[pileup.query_position])
+                site.snvs[alleleIndex].append(quality)
+                # Running sum so QUAL (mean error probability) needs no pass over the qualities
+                site.errorSums[alleleIndex] += PHRED_LUT_LIST[quality]
 
     def process_indel(self, position, pileup):
         if pileup.is_del or pileup.is_refskip:
             indel = '-' if pileup.is_del else f'+{pileup.alignment.query_sequence[pileup.query_position]}'
 
-            if indel not in self.memory[position]['indels'].keys():
-                # We could store more information here in the memory. But as the Base Qualty is the the only information that matters for further calculation we 
-                # save memory and only store them
-
-                self.memory[position]['indels'][indel] = []
+            # We could store more information here in the memory. But as the Base Qualty is the the only information that matters for further calculation we 
+            # save memory and only store them
+            qualities = self.memory[position].indels.setdefault(indel, [])
 
             if pileup.is_refskip:
-                self.memory[position]['indels'][indel].append(pileup.alignment.query_qualities[pileup.query_position])
+                qualities.append(pileup.alignment.query_qualities[pileup.query_position])
             else:
-                self.memory[position]['indels'][indel].append(None)
+                qualities.append(None)
 
     def prepare_variants(self):
+        positions = [
+            position for position in sorted(self.memory)
+            if self.memory[position].totalDepth >= self.minTotalDepth
+        ]
+        chunks = [
+            [(position, self.memory[position]) for position in positions[index:index + SCORING_CHUNK_SIZE]]
+            for index in range(0, len(positions), SCORING_CHUNK_SIZE)
+        ]
+
         timestamp = strftime('[%Y-%m-%d %H:%M:%S]', localtime())
         progressBar = tqdm(
-            self.memory,
             desc=f'{timestamp} Calculating statistics',
-            total=len(self.memory.keys())
+            total=len(positions)
         )
 
         variants: List[Variant] = []
 
-        for position in progressBar:
-            if self.memory[position]['totalDepth'] >= self.minTotalDepth:
-                snvs = {
-                    allele: [
-                        from_phred_scale(quality)
-                        for quality in self.memory[position]['snvs'][allele]
-                    ]
-                    for allele in self.memory[position]['snvs'].keys()
-                }
-
-                genotypeLikelihoods = {
-                    allele: genotype_likelihood(allele, snvs)
-                    for allele in snvs.keys()
-                }
-
-                sumGenotypeLikelihoods = functools.reduce(operator.add, genotypeLikelihoods.values(), 0.0)
-                sumGenotypeLikelihoods = sumGenotypeLikelihoods if sumGenotypeLikelihoods != 0 else 1.0
-
-                for allele in snvs.keys():
-                    alleleDepth = len(snvs[allele])
-
-                    filterConstrains = [
-                        self.memory[position]['reference'] != allele,
-                        alleleDepth >= self.minAlleleDepth,
-                        alleleDepth / self.memory[position]['totalDepth'] >= self.minEvidenceRatio
-                    ]
-
-                    if all(filterConstrains):
-                        genotypeLikelihood = genotypeLikelihoods[allele]
-
-                        if genotypeLikelihood != 0:
-                            gl = math.log10(genotypeLikelihood)
-                            pl = round(-10.0 * gl)
-                        else:
-                            gl = 0
-                            pl = 0
-
-                        score = to_phred_scale(1.0 - (genotypeLikelihoods[allele] / sumGenotypeLikelihoods))
-                        qual = np.mean(snvs[allele])
+        with (
+            ProcessPoolExecutor(self.workers, mp_context=SCORING_MP_CONTEXT) if self.workers > 1 else nullcontext()
+        ) as executor:
+            chunkVariants = (executor.map if executor else map)(
+                call_snvs,
+                chunks,
+                repeat(self.minAlleleDepth),
+                repeat(self.minEvidenceRatio)
+            )
+
+            for chunk, snvVariants in zip(chunks, chunkVariants):
+                variants.extend(snvVariants)
+                progressBar.update(len(chunk))
+
+        progressBar.close()
+
+        for position in positions:
+            site = self.memory[position]
+            totalDepth = site.totalDepth
 
+            for indel, qualities in site.indels.items():
+                alleleDepth = len(qualities)
+
+                filterConstrains = [
+                    alleleDepth >= self.minAlleleDepth,
+                    alleleDepth / totalDepth >= self.minEvidenceRatio
+                ]
+
+                if all(filterConstrains):
+                    if indel == '-':
                         variants.append({
                             'start': position,
                             'stop': position + 1,
                             'alleles': (
-                                self.memory[position]['reference'],
-                                allele
+                                site.reference,
+                                '*'
                             ),
-                            'qual': qual,
+                            'qual': 0,
                             'info': {
-                                'DP': self.memory[position]['totalDepth'],
+                                'DP': totalDepth,
                                 'AD': alleleDepth,
-                                'GL': gl,
-                                'PL': pl,
-                                'SCORE': score
+                                'GL': 0,
+                                'PL': 0,
+                                'SCORE': 0
+                            }
+                        })
+                    else:
+                        variants.append({
+                            'start': position,
+                            'stop': position + 1,
+                            'alleles': (
+                                '*',
+                                indel[1:]
+                            ),
+                            'qual': 0,
+                            'info': {
+                                'DP': totalDepth,
+                                'ED': alleleDepth,
+                                'GL': 0,
+                                'PL': 0,
+                                'SCORE': 0
                             }
                         })
-
-                for indel in self.memory[position]['indels'].keys():
-                    alleleDepth = len(self.memory[position]['indels'][indel])
-
-                    filterConstrains = [
-                        alleleDepth >= self.minAlleleDepth,
-                        alleleDepth / self.memory[position]['totalDepth'] >= self.minEvidenceRatio
-                    ]
-
-                    if all(filterConstrains):
-                        if indel == '-':
-                            variants.append({
-                                'start': position,
-                                'stop': position + 1,
-                                'alleles': (
-                                    self.memory[position]['reference'],
-                                    '*'
-                                ),
-                                'qual': 0,
-                                'info': {
-                                    'DP': self.memory[position]['totalDepth'],
-                                    'AD': alleleDepth,
-                                    'GL': 0,
-                                    'PL': 0,
-                                    'SCORE': 0
-                                }
-                            })
-                        else:
-                            variants.append({
-                                'start': position,
-                                'stop': position + 1,
-                                'alleles': (
-                                    '*',
-                                    indel[1:]
-                                ),
-                                'qual': 0,
-                                'info': {
-                                    'DP': self.memory[position]['totalDepth'],
-                                    'ED': alleleDepth,
-                                    'GL': 0,
-                                    'PL': 0,
-                                    'SCORE': 0
-                                }
-                            })
 
         return variants
 
-    def write_vcf(self, outputVfc: str):
-        print("VFC output", outputVfc)
+    def create_vcf_header(self) -> pysam.VariantHeader:
+        """
+        Builds the VCF header, it only depends on the reference and is shared by all written files
+        @return: VCF header
+        """
         vcfHeader = pysam.VariantHeader()
 
         vcfHeader.add_meta('INFO', items=[
@@ -271,31 +378,53 @@ class LiveVariantCaller:
             ('Description', 'Custom scoring function')
         ])
 
-        for reference in self.fastaFile.references:
-            vcfHeader.contigs.add(
-                reference,
-                self.fastaFile.get_reference_length(reference)
-            )
+        for reference, length in self.referenceLengths.items():
+            vcfHeader.contigs.add(reference, length)
 
-        vcfFile = pysam.VariantFile(outputVfc, mode='w', header=vcfHeader)
+        return vcfHeader
+
+    def write_vcf(self, outputVfc: str):
+        print("VFC output", outputVfc)
+        vcfFile = pysam.VariantFile(outputVfc, mode='w', header=self.vcfHeader, threads=self.workers)
 
         variants = self.prepare_variants()
         # gvariants = self.concat_deletions(variants)
 
-        for index, variant in enumerate(
-                sorted(variants, key=lambda variant: (variant['start'], variant['info']['SCORE']))):
-            vcfFile.write(
-                vcfFile.new_record(
-                    start=variant['start'],
-                    stop=variant['stop'],
-                    alleles=variant['alleles'],
-                    qual=variant['qual'],
-                    info=variant['info'],
-                )
-            )
+        # write() serializes the record immediately, so one record is refilled for every variant
+        record = vcfFile.new_record()
+
+        for variant in self.select_variants(variants):
+            record.alleles = variant['alleles']
+            record.start = variant['start']
+            record.stop = variant['stop']
+            record.qual = variant['qual']
+            record.info.clear()
+            record.info.update(variant['info'])
+
+            vcfFile.write(record)
 
         vcfFile.close()
 
+    def select_variants(self, variants: List[Variant]) -> List[Variant]:
+        """
+        Keeps the maxVariants best scored variants of every position, all variants if maxVariants is 0 or less
+        @param variants: variants in any order
+        @return: selected variants ordered by position and ascending score
+        """
+        if self.maxVariants <= 0:
+            return sorted(variants, key=lambda variant: (variant['start'], variant['info']['SCORE']))
+
+        selected: List[Variant] = []
+
+        for _, positionVariants in groupby(sorted(variants, key=itemgetter('start')), key=itemgetter('start')):
+            # Partial sort, only the best few of each position are ever written. Sorting them again
+            # keeps variants with equal scores in the same order as without a limit
+            best = sorted(heapq.nlargest(self.maxVariants, positionVariants, key=variant_score), key=variant_score)
+
+            selected.extend(best)
+
+        return selected
+
     def prev_variant(self, variants: List[Variant], variant: Variant):
         return next(
             (
@@ -1,9 +1,22 @@
 from typing import Dict, List, Tuple, TypedDict
-class Site(TypedDict):
-    reference: str
-    totalDepth: int
-    snvs: Dict[str, List[int]]
-    indels: Dict[str, List[int]]
+
+# Order of the per-allele quality slots in Site.snvs
+ALLELES = ('A', 'C', 'G', 'T')
+ALLELE_INDEX = {allele: index for index, allele in enumerate(ALLELES)}
+
+
+class Site:
+    """
+    Evidence collected at one reference position. Slotted as there is one instance per position
+    """
+    __slots__ = ('reference', 'totalDepth', 'snvs', 'errorSums', 'indels')
+
+    def __init__(self, reference: str, totalDepth: int = 0):
+        self.reference: str = reference
+        self.totalDepth: int = totalDepth
+        self.snvs: List[bytearray] = [bytearray() for _ in ALLELES]
+        self.errorSums: List[float] = [0.0 for _ in ALLELES]
+        self.indels: Dict[str, List[int]] = {}
 
 
 class Variant(TypedDict):
@@ -1,10 +1,24 @@
-import operator
-import functools
+import itertools
 import numpy as np
 
 import math
 
-from typing import Dict, List
+from typing import List, Tuple
+
+try:
+    from numba import njit
+    _NUMBA_AVAILABLE = True
+except ImportError:
+    _NUMBA_AVAILABLE = False
+
+# Error probability for every possible Phred quality (0..255)
+PHRED_LUT = np.power(10.0, -np.arange(256, dtype=np.float64) / 10.0)
+# Same table as plain floats for scalar lookups outside of NumPy
+PHRED_LUT_LIST = PHRED_LUT.tolist()
+# log10 of the error probability and of its complement, -inf for quality 0
+LOG_PHRED_LUT = -np.arange(256, dtype=np.float64) / 10.0
+with np.errstate(divide='ignore'):
+    LOG_COMPLEMENT_PHRED_LUT = np.log1p(-PHRED_LUT) / np.log(10.0)
 
 def from_phred_scale(score: float) -> float:
     return math.pow(10, score / -10)
@@ -13,17 +27,165 @@ def to_phred_scale(probability: float, threshold: int = 99) -> int:
     return min(round(-10 * math.log10(probability)), threshold) if probability > 0.0 else threshold
 
 
-def genotype_likelihood(hypothesis: str, alleles: Dict[str, List[float]]): 
-    hypothesisValue = (1.0 - np.array(alleles[hypothesis])).prod()
-    nonHypothesisValue = functools.reduce(operator.mul, {
-        allele: np.array(alleles[allele]).prod()
-        for allele in alleles
-        if allele != hypothesis
-    }.values(), 1.0)
+def snvs_to_csr(snvs: List[List[bytearray]]) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Concatenates the base qualities of several sites into one buffer
+    @param snvs: base qualities per allele index for every site
+    @return: uint8 qualities and offsets, qualities of allele a at site s are
+             qualities[offsets[s * alleles + a]:offsets[s * alleles + a + 1]]
+    """
+    depths = [len(qualities) for site in snvs for qualities in site]
+    offsets = np.zeros(len(depths) + 1, dtype=np.int64)
+    np.cumsum(depths, out=offsets[1:])
+    qualities = np.frombuffer(b''.join(itertools.chain.from_iterable(snvs)), dtype=np.uint8)
+
+    return qualities, offsets
+
+
+def score_sites(qualities: np.ndarray, offsets: np.ndarray, alleleCount: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Scores every allele of every site in one pass. Likelihoods are handled as log10 values
+    throughout, so deep sites do not underflow
+    @param qualities: base qualities as returned by snvs_to_csr
+    @param offsets: allele offsets as returned by snvs_to_csr
+    @param alleleCount: number of alleles per site
+    @return: GL, PL and SCORE arrays of shape (sites, alleles), zero for alleles without reads
+    """
+    if _NUMBA_AVAILABLE:
+        return _score_sites_numba(qualities, offsets, alleleCount)
+
+    return _score_sites_numpy(qualities, offsets, alleleCount)
+
+
+def _log10_sum(values: np.ndarray) -> np.ndarray:
+    """
+    log10 of the sum of 10 ** values along the last axis, -inf if all values are -inf
+    """
+    maximum = values.max(axis=-1, keepdims=True)
+    maximum = np.where(np.isfinite(maximum), maximum, 0.0)
+
+    with np.errstate(divide='ignore'):
+        return maximum[..., 0] + np.log10(np.power(10.0, values - maximum).sum(axis=-1))
+
+
+def _score_sites_numpy(qualities: np.ndarray, offsets: np.ndarray, alleleCount: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    depths = np.diff(offsets).reshape(-1, alleleCount)
+    observed = depths > 0
+
+    if depths.size == 0:
+        return np.zeros(depths.shape), np.zeros(depths.shape, dtype=np.int64), np.zeros(depths.shape, dtype=np.int64)
+
+    # A trailing 0.0 keeps reduceat valid for empty alleles at the end, their sums are masked below
+    errorSums = np.add.reduceat(np.append(LOG_PHRED_LUT[qualities], 0.0), offsets[:-1]).reshape(depths.shape)
+    errorSums = np.where(observed, errorSums, 0.0)
+    hypothesisSums = np.add.reduceat(np.append(LOG_COMPLEMENT_PHRED_LUT[qualities], 0.0), offsets[:-1]).reshape(depths.shape)
+
+    # Error sums of all other alleles, from prefix and suffix sums
+    zeros = np.zeros((depths.shape[0], 1))
+    leftSums = np.cumsum(np.hstack([zeros, errorSums[:, :-1]]), axis=1)
+    rightSums = np.cumsum(np.hstack([zeros, errorSums[:, :0:-1]]), axis=1)[:, ::-1]
+
+    logLikelihoods = np.where(observed, hypothesisSums + leftSums + rightSums, -np.inf)
+    logSum = _log10_sum(logLikelihoods)[:, np.newaxis]
+
+    # 1 - P(allele) as the sum over the other alleles, which keeps its precision when P(allele) is close to 1
+    others = np.where(np.eye(alleleCount, dtype=bool), -np.inf, logLikelihoods[:, np.newaxis, :])
+    logComplements = _log10_sum(others)
+
+    finite = np.isfinite(logLikelihoods)
+    gl = np.where(finite, logLikelihoods, 0.0)
+    pl = np.round(-10.0 * gl).astype(np.int64)
+
+    with np.errstate(invalid='ignore'):
+        score = np.minimum(np.round(-10.0 * (logComplements - logSum)), 99)
+
+    score = np.where(np.isfinite(logSum), score, 0).astype(np.int64)
+    score[~observed] = 0
+
+    return gl, pl, score
+
+
+def _score_sites_numba(qualities: np.ndarray, offsets: np.ndarray, alleleCount: int):
+    """
+    Same computation as _score_sites_numpy as one loop over the sites
+    """
+    siteCount = (offsets.shape[0] - 1) // alleleCount
+    gl = np.zeros((siteCount, alleleCount))
+    pl = np.zeros((siteCount, alleleCount), dtype=np.int64)
+    score = np.zeros((siteCount, alleleCount), dtype=np.int64)
+    errorSums = np.empty(alleleCount)
+    hypothesisSums = np.empty(alleleCount)
+    logLikelihoods = np.empty(alleleCount)
+
+    for site in range(siteCount):
+        first = site * alleleCount
+
+        for index in range(alleleCount):
+            errorSums[index] = 0.0
+            hypothesisSums[index] = 0.0
+
+            for quality in qualities[offsets[first + index]:offsets[first + index + 1]]:
+                errorSums[index] += LOG_PHRED_LUT[quality]
+                hypothesisSums[index] += LOG_COMPLEMENT_PHRED_LUT[quality]
+
+        for index in range(alleleCount):
+            logLikelihoods[index] = -np.inf
+
+            if offsets[first + index + 1] == offsets[first + index]:
+                continue
+
+            logLikelihood = hypothesisSums[index]
+
+            for other in range(alleleCount):
+                if other != index:
+                    logLikelihood += errorSums[other]
+
+            logLikelihoods[index] = logLikelihood
+
+        maximum = logLikelihoods.max()
+
+        if maximum == -np.inf:
+            continue
+
+        total = 0.0
+
+        for index in range(alleleCount):
+            total += 10.0 ** (logLikelihoods[index] - maximum)
+
+        logSum = maximum + math.log10(total)
+
+        for index in range(alleleCount):
+            if offsets[first + index + 1] == offsets[first + index]:
+                continue
+
+            if logLikelihoods[index] != -np.inf:
+                gl[site, index] = logLikelihoods[index]
+                pl[site, index] = round(-10.0 * gl[site, index])
+
+            othersMaximum = -np.inf
+
+            for other in range(alleleCount):
+                if other != index and logLikelihoods[other] > othersMaximum:
+                    othersMaximum = logLikelihoods[other]
+
+            if othersMaximum == -np.inf:
+                score[site, index] = 99
+                continue
 
-    return hypothesisValue * nonHypothesisValue
+            othersTotal = 0.0
 
+            for other in range(alleleCount):
+                if other != index:
+                    othersTotal += 10.0 ** (logLikelihoods[other] - othersMaximum)
 
+            logComplement = othersMaximum + math.log10(othersTotal)
+            score[site, index] = min(round(-10.0 * (logComplement - logSum)), 99)
 
+    return gl, pl, score
 
 
+if _NUMBA_AVAILABLE:
+    _score_sites_numba = njit(cache=True)(_score_sites_numba)
+    # Compile once at import so the first chunk does not pay for it, with the read-only
+    # buffer type snvs_to_csr produces
+    _score_sites_numba(np.frombuffer(bytes(1), dtype=np.uint8), np.array([0, 1], dtype=np.int64), 1)